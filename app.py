@@ -1,31 +1,55 @@
 # main module with the Slack app
 
 import os
+import atexit
+import logging
+import threading
+import time
+import weakref
 import slack
-from flask import Flask, json, request, render_template, session, Response, abort, redirect
+from flask import Flask, json, request, render_template, session, Response, abort, redirect, g
+from flask.sessions import SecureCookieSessionInterface
+from flask.logging import default_handler
 import psycopg2
+import psycopg2.pool
+import psycopg2.extras
 import urllib
 import secrets
 import requests
 import hmac
 import hashlib
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 from slack_objects import Blocks, ActionsBlock, Button, Section, ConfirmationDialog, ResponseMessage
+from json_utils import json_loads, json_dumps
 
 # environment variables
 DATABASE_URL = os.environ['DATABASE_URL']
 SLACK_CLIENT_ID = os.environ["SLACK_CLIENT_ID"]
 SLACK_CLIENT_SECRET = os.environ["SLACK_CLIENT_SECRET"]
 SLACK_SIGNING_SECRET = os.environ["SLACK_SIGNING_SECRET"]
+SLACK_SIGNING_SECRET_BYTES = SLACK_SIGNING_SECRET.encode("utf-8")
 FLASK_SECRET_KEY = os.environ["FLASK_SECRET_KEY"]
+# one DB connection per gunicorn thread, see Procfile
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "8"))
+RESPONSE_WORKERS_MAX = int(os.environ.get("RESPONSE_WORKERS_MAX", "8"))
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_NEGATIVE_TTL = int(os.environ.get("AUTH_CACHE_NEGATIVE_TTL", "10"))
+AUTH_CACHE_MAXSIZE = int(os.environ.get("AUTH_CACHE_MAXSIZE", "10000"))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING").upper()
+
+# only configure our own logger, so importing this module 
+# does not change the logging of gunicorn, tests or scripts
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(default_handler)
 
 # session constants
 SESSION_TEAM_ID = "team_id"
 SESSION_USER_ID = "user_id"
 SESSION_STATE = "state"
 SESSION_INSTALL_TYPE = "install_type"
-SESSION_SCOPES_PRESELECTED = "scopes_preselected"
 
 INSTALL_TYPE_ADD = "add_scopes"
 INSTALL_TYPE_NEW = "new_install"
@@ -39,6 +63,11 @@ QUERY_OAUTH_ERROR = "error"
 QUERY_OAUTH_SCOPE = "scope"
 QUERY_OAUTH_STATE = "state"
 QUERY_OAUTH_TEAM = "team"
+# constant start of all our OAuth URLs
+URL_OAUTH_PREFIX = (
+    URL_OAUTH_AUTH + "?" 
+    + urllib.parse.urlencode({QUERY_OAUTH_CLIENT_ID: SLACK_CLIENT_ID})
+)
 
 # mytoken query constants
 QUERY_SCOPES = "scopes"
@@ -50,36 +79,155 @@ AID_BUTTON_NEW = "button_new"
 AID_BUTTON_REMOVE = "button_remove"
 AID_BUTTON_REFRESH = "button_refresh"
 
+# response to Slack when a request could not be processed
+SLACK_ERROR_RESPONSE = json.dumps({"text": "An internal error has occurred"})
+
+# max age of Slack requests in seconds, older requests are rejected as replays
+SLACK_REQUEST_MAX_AGE = 60 * 5
+
 ##########################################
 # Utility functions
 #
 
 def is_slack_request_valid(
         ts: str, 
-        body: str, 
+        body: bytes, 
         signature: str, 
-        signing_secret:str ) -> bool:
+        signing_secret: bytes) -> bool:
     """verifies a request with signed secret approach
     
     Args:
         ts = timestamp of request from X-Slack-Request-Timestamp header
-        body = string of request body
+        body = raw bytes of request body
         signature = signature of request from X-Slack-Signature header
-        signing_secret = signing secret of this app
+        signing_secret = signing secret of this app as bytes
     
     Returns:
-        true if signatures match
+        true if signatures match and request is not older than 5 minutes
         false otherwise
     """
     version = "v0"        
-    base_string = ":".join([version, ts, body])    
-    h = hmac.new(
-        signing_secret.encode("utf-8"), 
-        base_string.encode("utf-8"), 
-        hashlib.sha256 
-    )
+    # reject malformed signatures and old requests before hashing the body
+    if (not signature.startswith(version + "=") 
+            or len(signature) != len(version) + 1 + 64):
+        return False
+    try:
+        if abs(time.time() - int(ts)) > SLACK_REQUEST_MAX_AGE:
+            return False
+    except ValueError:
+        return False
+
+    base_string = (version + ":" + ts + ":").encode("utf-8") + body
+    h = hmac.new(signing_secret, base_string, hashlib.sha256)
     my_signature = version + "=" + h.hexdigest()
-    return my_signature == signature    
+    return hmac.compare_digest(
+        my_signature.encode("utf-8"), 
+        signature.encode("utf-8")
+    )
+
+
+def create_oauth_url(scopes: str, state: str, team_id: str = None) -> str:
+    """returns the Slack URL for starting an OAuth authorization
+    
+    Args:
+        scopes = string of scopes to request
+        state = state for verifying the OAuth response
+        team_id = ID of the Slack workspace to authorize for (optional)
+    
+    Returns:
+        URL with all parameters properly encoded
+    """
+    query = {
+        QUERY_OAUTH_SCOPE: scopes,
+        QUERY_OAUTH_STATE: state
+    }
+    if team_id is not None:
+        query[QUERY_OAUTH_TEAM] = team_id
+    return URL_OAUTH_PREFIX + "&" + urllib.parse.urlencode(query)
+
+
+# process wide DB connection pool, created on first use
+# so that forked workers do not share connections
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    """returns the DB connection pool for this process"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                # connections are only opened when needed
+                _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=1, 
+                    maxconn=DB_POOL_MAX, 
+                    dsn=DATABASE_URL
+                )
+                # the pool closes returned connections beyond minconn,
+                # so we raise it to keep all of them for reuse
+                _db_pool.minconn = DB_POOL_MAX
+                atexit.register(_db_pool.closeall)
+    return _db_pool
+
+
+def get_db_connection() -> object:
+    """returns a pooled DB connection for the current request
+    
+    The connection is checked out from the pool on first use 
+    and returned to the pool when the app context is torn down
+    """
+    if "db_connection" not in g:
+        g.db_connection = get_db_pool().getconn()
+    return g.db_connection
+
+
+# names of the statements already prepared on each DB connection
+_prepared_statements = weakref.WeakKeyDictionary()
+
+def execute_prepared(
+        cursor: object, 
+        name: str, 
+        sql_query: str, 
+        record: tuple) -> None:
+    """executes a query as server side prepared statement
+
+    The statement is prepared once per connection and then reused,
+    so Postgres only has to parse and plan it once per connection.
+    Since the pool keeps its connections open across requests 
+    this effectively removes parsing and planning from the request path.
+    
+    Args:
+        cursor: cursor of the current postgres connection
+        name: unique name of the statement
+        sql_query: query with $1, $2, ... as placeholders
+        record: values for the placeholders
+    """
+    prepared = _prepared_statements.setdefault(cursor.connection, set())
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {sql_query}")
+        prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(record))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", record)
+
+
+# threads for sending response messages to Slack in the background
+_response_executor = ThreadPoolExecutor(max_workers=RESPONSE_WORKERS_MAX)
+
+def _log_send_error(future: object) -> None:
+    """logs the error if sending a response message failed"""
+    error = future.exception()
+    if error is not None:
+        logger.error("Failed to send response message: %s", error)
+
+def send_in_background(
+        response_msg: ResponseMessage, 
+        response_url: str) -> None:
+    """sends a response message to Slack without blocking the current request
+
+    Errors can not be reported back to the request and are only logged
+    """
+    future = _response_executor.submit(response_msg.send, response_url)
+    future.add_done_callback(_log_send_error)
 
 
 ##########################################
@@ -92,6 +240,12 @@ class Scopes:
     SCOPE_COMMANDS = "commands"
     SCOPE_IDENTIFY = "identify"
 
+    __slots__ = ("_scopes", "_sorted", "_string")
+
+    # shared string object for each known scope name, filled from SCOPES_ALL
+    # unknown names are not added, since they can come from any request
+    _canonical_names = dict()
+
     def __init__(self, scopes: set=None):
         if scopes is None:
             scopes = set()
@@ -103,15 +257,38 @@ class Scopes:
                 f"strings in scopes can not contain {self.DELIMITER}"
             )
         
-        self._scopes = scopes                    
+        # scope names come from a small vocabulary, so we share 
+        # one string object per known name across all Scopes objects
+        canonical = self._canonical_names.get
+        self._scopes = {canonical(s, s) for s in scopes}
+        self._reset_cache()
+
+    @classmethod
+    def _create_trusted(cls, scopes: set) -> "Scopes":
+        """creates a new object from a set of already validated scopes
+
+        Skips the validation of __init__, so must only be used 
+        with scopes that can not contain the delimiter
+        """
+        obj = cls.__new__(cls)
+        obj._scopes = scopes
+        obj._reset_cache()
+        return obj
+
+    def _reset_cache(self) -> None:
+        """clears the cached sorted representations of the scopes"""
+        self._sorted = None
+        self._string = None
         
     @property
     def scopes(self):
         return self._scopes
 
     def __add__(self, s2: "Scopes") -> "Scopes":
-        s_sum = self._scopes.union(s2.scopes)
-        return Scopes(s_sum)
+        # copy into a set first, so the result is never read-only
+        s_sum = set(self._scopes)
+        s_sum |= s2._scopes
+        return Scopes._create_trusted(s_sum)
 
     def __contains__(self, key: str) -> bool:
         return key in self._scopes
@@ -121,7 +298,7 @@ class Scopes:
         # Objects of a different class are never equal
         if type(other) != type(self):
             return False
-        return self.scopes == other.scopes
+        return self._scopes == other._scopes
 
     def __ne__(self, other):
         """change comparison for this object type to by value"""
@@ -132,62 +309,86 @@ class Scopes:
 
     def get_count(self) -> int:
         """returns the count of scopes"""
-        return len(self.scopes)
+        return len(self._scopes)
 
     def get_string(self) -> str:
-        scopes_list = list(self._scopes)
-        scopes_list.sort()
-        return self.DELIMITER.join(scopes_list)
+        if self._string is None:
+            self._string = self.DELIMITER.join(self._get_sorted())
+        return self._string
 
     def add(self, scope: str) -> None: 
+        if isinstance(self._scopes, frozenset):
+            raise TypeError("can not add to read-only scopes")
         if not isinstance(scope, str):
             raise TypeError("scope must be of type string")
         if self.DELIMITER in scope:
             raise ValueError(f"scope can not contain {self.DELIMITER}")
 
-        self._scopes.add(scope)
+        self._scopes.add(self._canonical_names.get(scope, scope))
+        self._reset_cache()
    
     def diff(self, scopes_second: "Scopes") -> "Scopes":
         if not isinstance(scopes_second, Scopes):
             raise TypeError("scopes_second must be of type Scopes")
-        scopes_diff = self._scopes.difference(scopes_second.scopes)
-        return Scopes(scopes_diff)
+        scopes_diff = set(self._scopes)
+        scopes_diff -= scopes_second._scopes
+        return Scopes._create_trusted(scopes_diff)
 
     def get_list(self) -> list:
-        scopes_list = list(self._scopes)
-        scopes_list.sort()
-        return scopes_list
+        return list(self._get_sorted())
+
+    def get_frozen(self) -> "Scopes":
+        """returns a read-only copy of this object, backed by a frozenset"""
+        return Scopes._create_trusted(frozenset(self._scopes))
+
+    def _get_sorted(self) -> tuple:
+        """returns the scopes sorted, will only sort once per change"""
+        if self._sorted is None:
+            self._sorted = tuple(sorted(self._scopes))
+        return self._sorted
     
     @classmethod
     def create_from_string(cls, scopes_str: str) -> "Scopes":
-        scopes = set(scopes_str.split(cls.DELIMITER))
-        if "" in scopes:
-            scopes.remove("")
-        return cls(scopes)
+        # parts of a split can not contain the delimiter, 
+        # so there is no need to validate them again
+        canonical = cls._canonical_names.get
+        scopes = {
+            canonical(s, s) for s in scopes_str.split(cls.DELIMITER) if s
+        }
+        return cls._create_trusted(scopes)
 
     @classmethod
     def create_from_file(cls, filename: str) -> "Scopes":
         """reads a json file and returns its contents as new object"""     
         filename += '.json'
-        if not os.path.isfile(filename):
+        try:
+            with open(filename, 'rb') as f:
+                arr = json_loads(f.read())
+        except FileNotFoundError:
             raise RuntimeError(f"file does not exist: {filename}")
-            
-        else:
-            try:
-                with open(filename, 'r', encoding="utf-8") as f:
-                    arr = json.load(f)            
-            except Exception as e:
-                raise RuntimeError(
-                     f"WARN: failed to read from {filename}: {e} "
-                )
-            scopes = set()
-            for scope in arr:
-                if scope["enabled"]:
-                    scopes.add(scope["scope"])    
+        except Exception as e:
+            raise RuntimeError(
+                 f"WARN: failed to read from {filename}: {e} "
+            )
+        scopes = set()
+        for scope in arr:
+            if scope["enabled"]:
+                scopes.add(scope["scope"])    
             
         return cls(scopes)
 
 
+# all scopes users can choose from, read from file once at startup
+# and shared by all requests, so we make it read-only
+SCOPES_ALL = Scopes.create_from_file(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "scopes")
+).get_frozen()
+Scopes._canonical_names = {
+    s: s 
+    for s in (*SCOPES_ALL.scopes, Scopes.SCOPE_COMMANDS, Scopes.SCOPE_IDENTIFY)
+}
+
+
 class Authorization:
     """A token for a Slack team and user
     
@@ -196,6 +397,24 @@ class Authorization:
         name: team name
         token: Slack token
     """
+    __slots__ = (
+        "_team_id", 
+        "_user_id", 
+        "_team_name", 
+        "_user_name", 
+        "_scopes", 
+        "_token", 
+        "_last_update"
+    )
+
+    # process local cache for fetchFromDb: (team_id, user_id) -> (expires, obj)
+    # obj is None if there is no auth for that team and user
+    _cache = dict()
+    _cache_lock = threading.Lock()
+    # incremented on every invalidation, so fetches started before
+    # an invalidation can not put an outdated object into the cache
+    _cache_generation = 0
+
     def __init__(
             self, 
             team_id: str, 
@@ -225,6 +444,26 @@ class Authorization:
         self._token = str(token)[:255]        
         self._last_update  = last_update
 
+    @classmethod
+    def _create_from_record(cls, record: tuple) -> "Authorization":
+        """creates a new object from a DB record, skipping validation
+        
+        Values from the DB are already within the limits of their columns,
+        so they do not need to be converted and truncated again
+        """
+        obj = cls.__new__(cls)
+        (
+            obj._team_id,
+            obj._user_id,
+            obj._team_name,
+            obj._user_name,
+            scopes_str,
+            obj._token,
+            obj._last_update
+        ) = record
+        obj._scopes = Scopes.create_from_string(scopes_str)
+        return obj
+
     @property
     def team_id(self) -> str:
         return self._team_id
@@ -286,12 +525,12 @@ class Authorization:
             "token": self.token,
             "last_update": self.last_update.isoformat()
         }
-        return json.dumps(arr)
+        return json_dumps(arr)
 
     @classmethod
     def json_loads(cls, json_str: str) -> "Authorization":
         """returns a new object from the provided JSON representation"""
-        arr = json.loads(json_str)
+        arr = json_loads(json_str)
         tz_utc = pytz.timezone("UTC")
         return Authorization(
             arr["team_id"],
@@ -304,10 +543,71 @@ class Authorization:
         )
 
     #############
-    # DB related methods        
+    # cache related methods
+    @classmethod
+    def _cache_get(cls, team_id: str, user_id: str) -> tuple:
+        """returns a tuple of (found, obj) for the cached object
+        
+        found is False if not cached or expired
+        """
+        entry = cls._cache.get((team_id, user_id))
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    @classmethod
+    def _cache_set(
+            cls, 
+            team_id: str, 
+            user_id: str, 
+            obj: any, 
+            generation: int):
+        """adds an object or None to the cache, 
+        evicting the oldest entry if full
+
+        Does nothing if the cache was invalidated since generation was read
+        """
+        ttl = AUTH_CACHE_TTL if obj is not None else AUTH_CACHE_NEGATIVE_TTL
+        if ttl <= 0:
+            return
+        key = (team_id, user_id)
+        with cls._cache_lock:
+            if generation != cls._cache_generation:
+                return
+            cls._cache.pop(key, None)
+            if len(cls._cache) >= AUTH_CACHE_MAXSIZE:
+                del cls._cache[next(iter(cls._cache))]
+            cls._cache[key] = (time.monotonic() + ttl, obj)
+
+    @classmethod
+    def cache_invalidate(cls, team_id: str, user_id: str):
+        """removes the object for team and user from the cache
+        
+        Must be called after a change to that object has been committed,
+        so that no other thread can cache the old object again
+        """
+        with cls._cache_lock:
+            cls._cache_generation += 1
+            cls._cache.pop((team_id, user_id), None)
+
+    @classmethod
+    def cache_clear(cls):
+        """removes all objects from the cache"""
+        with cls._cache_lock:
+            cls._cache_generation += 1
+            cls._cache.clear()
+
+    #############
+    # DB related methods
+    # none of them commit, the caller is responsible for committing,
+    # e.g. by using the connection as context manager: 
+    # with get_db_connection() as connection: ...
+    # and for calling cache_invalidate for changed objects after the commit
     def store(self, connection: object):
         """stores the current object to database. will overwrite existing.
 
+        Does not commit or invalidate the cache
+
         Args:
             connection: current postgres connection
 
@@ -327,14 +627,14 @@ class Authorization:
                         token,                         
                         last_update
                     ) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s) 
+                    VALUES ($1, $2, $3, $4, $5, $6, $7) 
                     ON CONFLICT (team_id, user_id)
                     DO UPDATE SET 
-                        team_name=%s,
-                        user_name=%s, 
-                        scopes=%s, 
-                        token=%s,                         
-                        last_update=%s
+                        team_name=EXCLUDED.team_name,
+                        user_name=EXCLUDED.user_name, 
+                        scopes=EXCLUDED.scopes, 
+                        token=EXCLUDED.token,                         
+                        last_update=EXCLUDED.last_update
                 """
                 record = (
                     self.team_id, 
@@ -343,23 +643,80 @@ class Authorization:
                     self.user_name,
                     self.scopes.get_string(), 
                     self.token,                     
-                    self.last_update,
-                    self.team_name,
-                    self.user_name,                 
-                    self.scopes.get_string(), 
-                    self.token,                    
                     self.last_update
                 )
-                cursor.execute(sql_query, record)
-                connection.commit()
+                execute_prepared(cursor, "mytoken_store", sql_query, record)
+        except (Exception, psycopg2.Error) as error:            
+            logger.warning("Failed to insert record into table: %s", error)
+            raise error
+
+    @classmethod
+    def store_many(cls, connection: object, auths: list):
+        """stores many objects to database in one round-trip. 
+        will overwrite existing.
+
+        Does not commit or invalidate the cache
+
+        Args:
+            connection: current postgres connection
+            auths: list of Authorization objects
+
+        Exceptions:
+            on any error
+
+        """
+        # one statement can not update the same row twice, 
+        # so only the last object per team and user is stored
+        auths_unique = {(x.team_id, x.user_id): x for x in auths}
+        records = [
+            (
+                x.team_id, 
+                x.user_id, 
+                x.team_name,
+                x.user_name,
+                x.scopes.get_string(), 
+                x.token,                     
+                x.last_update
+            ) 
+            for x in auths_unique.values()
+        ]
+        try:                
+            with connection.cursor() as cursor:                
+                sql_query = """INSERT INTO mytoken_auths 
+                    (
+                        team_id, 
+                        user_id, 
+                        team_name, 
+                        user_name,
+                        scopes, 
+                        token,                         
+                        last_update
+                    ) 
+                    VALUES %s 
+                    ON CONFLICT (team_id, user_id)
+                    DO UPDATE SET 
+                        team_name=EXCLUDED.team_name,
+                        user_name=EXCLUDED.user_name, 
+                        scopes=EXCLUDED.scopes, 
+                        token=EXCLUDED.token,                         
+                        last_update=EXCLUDED.last_update
+                """
+                psycopg2.extras.execute_values(
+                    cursor, 
+                    sql_query, 
+                    records, 
+                    page_size=1000
+                )
         except (Exception, psycopg2.Error) as error:            
-            print("WARN: Failed to insert record into table", error)
+            logger.warning("Failed to insert records into table: %s", error)
             raise error
                 
             
     def delete(self, connection: object):
         """deletes the current object in DB
 
+        Does not commit or invalidate the cache
+
         Args:
             connection: current postgres connection
 
@@ -370,30 +727,81 @@ class Authorization:
         try:                
             with connection.cursor() as cursor:
                 sql_query = """DELETE FROM mytoken_auths 
-                    WHERE team_id = %s
-                    AND user_id = %s                        
+                    WHERE team_id = $1
+                    AND user_id = $2
                 """
                 record = (
                     self._team_id, 
                     self._user_id
                 )
-                cursor.execute(sql_query, record)
-                connection.commit()
+                execute_prepared(cursor, "mytoken_delete", sql_query, record)
         except (Exception, psycopg2.Error) as error:            
-            print("WARN: Failed to delete record from table", error)
+            logger.warning("Failed to delete record from table: %s", error)
             raise error
 
     @classmethod
-    def fetchFromDb(
+    def delete_returning(
             cls, 
             connection: object, 
             team_id: str, 
             user_id: str) -> any:
+        """deletes an object in DB and returns its token in one round-trip
+        
+        Does not commit or invalidate the cache, 
+        so the caller can still roll back the deletion,
+        e.g. when revoking the returned token fails
+
+        Args:
+            connection: current postgres connection
+            team_id: team ID of object to be deleted
+            user_id: user ID of object to be deleted
+
+        Returns:
+            token of the deleted object or None if not found
+
+        Exceptions:
+            on any error
+
+        """
+        try:                
+            with connection.cursor() as cursor:
+                sql_query = """DELETE FROM mytoken_auths 
+                    WHERE team_id = $1
+                    AND user_id = $2
+                    RETURNING token
+                """
+                execute_prepared(
+                    cursor, 
+                    "mytoken_delete_returning", 
+                    sql_query, 
+                    (team_id, user_id)
+                )
+                record = cursor.fetchone()
+        except (Exception, psycopg2.Error) as error:            
+            logger.warning("Failed to delete record from table: %s", error)
+            raise error
+
+        return None if record is None else record[0]
+
+    @classmethod
+    def fetchFromDb(
+            cls, 
+            connection: object, 
+            team_id: str, 
+            user_id: str,
+            use_cache: bool = True) -> any:
         """fetches an object from database by its team ID
+
+        Found objects are cached in memory for AUTH_CACHE_TTL seconds,
+        not found ones for AUTH_CACHE_NEGATIVE_TTL seconds.
+        The cache is per process, so changes made by other processes 
+        can be missed until the entry expires
          
          Args:            
             connection: current postgres connection
             id: team ID of object to be fetched
+            use_cache: set to False to always read from DB, 
+                e.g. right after a write from another process
 
         Returns:
             the Authorization object when found or None if not found
@@ -401,6 +809,12 @@ class Authorization:
         Exceptions:
             on any error
         """
+        if use_cache:
+            found, obj = cls._cache_get(team_id, user_id)
+            if found:
+                return obj
+        generation = cls._cache_generation
+
         try:            
             with connection.cursor() as cursor:
                 sql_query = """SELECT 
@@ -412,29 +826,29 @@ class Authorization:
                         token,                        
                         last_update
                     FROM mytoken_auths 
-                    WHERE team_id = %s
-                    AND user_id = %s"""                
-                cursor.execute(sql_query, (team_id, user_id))            
+                    WHERE team_id = $1
+                    AND user_id = $2
+                    LIMIT 1"""                
+                execute_prepared(
+                    cursor, 
+                    "mytoken_fetch", 
+                    sql_query, 
+                    (team_id, user_id)
+                )
                 record = cursor.fetchone()
                 if (record == None):
-                    print(
-                        f"WARN: Could not find a token for team {team_id} "
-                            + f"and user {user_id}"
+                    logger.info(
+                        "Could not find a token for team %s and user %s",
+                        team_id,
+                        user_id
                     )
                     obj = None
                 else:                
-                    obj = Authorization(
-                        record[0], 
-                        record[1], 
-                        record[2], 
-                        record[3],
-                        Scopes.create_from_string(record[4]), 
-                        record[5], 
-                        record[6]
-                    )
+                    obj = cls._create_from_record(record)
+                cls._cache_set(team_id, user_id, obj, generation)
             
         except (Exception, psycopg2.Error) as error :
-            print("Error while fetching data from PostgreSQL", error)
+            logger.warning("Error while fetching data from PostgreSQL: %s", error)
             raise
 
         return obj
@@ -460,9 +874,14 @@ class Authorization:
             with connection.cursor() as cursor:
                 sql_query = """SELECT COUNT(*)
                     FROM mytoken_auths 
-                    WHERE team_id = %s
+                    WHERE team_id = $1
                     """                
-                cursor.execute(sql_query, (team_id,))
+                execute_prepared(
+                    cursor, 
+                    "mytoken_count", 
+                    sql_query, 
+                    (team_id,)
+                )
                 record = cursor.fetchone()
                 if (record == None):
                     raise RuntimeError(
@@ -472,7 +891,7 @@ class Authorization:
                     count = record[0]                    
             
         except (Exception, psycopg2.Error) as error :
-            print("Error while fetching data from PostgreSQL", error)
+            logger.warning("Error while fetching data from PostgreSQL: %s", error)
             raise
 
         return count
@@ -496,11 +915,18 @@ class Authorization:
         """
         try:            
             with connection.cursor() as cursor:
-                sql_query = """SELECT DISTINCT team_name
+                sql_query = """SELECT team_name
                     FROM mytoken_auths 
-                    WHERE team_id = %s
+                    WHERE team_id = $1
+                    ORDER BY last_update DESC
+                    LIMIT 1
                     """                
-                cursor.execute(sql_query, (team_id,))
+                execute_prepared(
+                    cursor, 
+                    "mytoken_workspace_name", 
+                    sql_query, 
+                    (team_id,)
+                )
                 record = cursor.fetchone()
                 if (record == None):
                     team_name = None
@@ -508,14 +934,42 @@ class Authorization:
                     team_name = record[0]
             
         except (Exception, psycopg2.Error) as error :
-            print("Error while fetching data from PostgreSQL", error)
+            logger.warning("Error while fetching data from PostgreSQL: %s", error)
             raise
 
         return team_name
 
 
+class NoSlackSessionInterface(SecureCookieSessionInterface):
+    """Session interface which skips sessions for requests from Slack
+
+    Slack never sends our session cookie and the Slack endpoints 
+    do not use the session, so we neither load nor sign one for them
+    """
+    SLACK_PATHS = ("/slash", "/interactive")
+
+    def open_session(self, app, request):
+        if request.path in self.SLACK_PATHS:
+            return self.make_null_session(app)
+        return super().open_session(app, request)
+
+
 app = Flask(__name__)
 app.secret_key = FLASK_SECRET_KEY
+app.session_interface = NoSlackSessionInterface()
+
+# compile all templates at startup instead of on their first request
+# outside of debug mode Jinja will then serve them from its cache
+for template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(template_name)
+
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """returns the DB connection of the current request to the pool"""
+    connection = g.pop("db_connection", None)
+    if connection is not None:
+        get_db_pool().putconn(connection)
 
 
 ##########################################
@@ -530,8 +984,9 @@ def web_select_scopes():
     If called with team_id and user_id will add scopes to existing ones    
     """
         
-    session[SESSION_STATE] = secrets.token_urlsafe(20)
-    scopes_all = Scopes.create_from_file("scopes")
+    # reuse the state of an unfinished authorization in this session
+    if SESSION_STATE not in session:
+        session[SESSION_STATE] = secrets.token_urlsafe(20)
     
     if QUERY_TEAM_ID in request.args and QUERY_USER_ID in request.args:
         team_id = request.args[QUERY_TEAM_ID]
@@ -540,7 +995,7 @@ def web_select_scopes():
         session[SESSION_USER_ID] = user_id
         session[SESSION_INSTALL_TYPE] = INSTALL_TYPE_ADD
         
-        with psycopg2.connect(DATABASE_URL) as connection:
+        with get_db_connection() as connection:
             my_auth = Authorization.fetchFromDb(
                 connection, 
                 team_id,
@@ -563,8 +1018,7 @@ def web_select_scopes():
         else:
             scopes_added = None
 
-        session[SESSION_SCOPES_PRESELECTED] = scopes_preselected.get_string()
-        scopes_remain = scopes_all.diff(scopes_preselected)
+        scopes_remain = SCOPES_ALL.diff(scopes_preselected)
                     
         return render_template(
             'select.html.j2', 
@@ -583,12 +1037,10 @@ def web_select_scopes():
         team_name = None
         user_name = None
     
-        query = {            
-            QUERY_OAUTH_CLIENT_ID: SLACK_CLIENT_ID,            
-            QUERY_OAUTH_SCOPE: scopes_preselected.get_string(),
-            QUERY_OAUTH_STATE: session[SESSION_STATE],            
-        }
-        oauth_url = URL_OAUTH_AUTH + "?" + urllib.parse.urlencode(query)
+        oauth_url = create_oauth_url(
+            scopes_preselected.get_string(), 
+            session[SESSION_STATE]
+        )
         return render_template(
             'install_start.html.j2',
             oauth_url=oauth_url
@@ -597,45 +1049,38 @@ def web_select_scopes():
 
 @app.route("/confirm", methods=["POST"])
 def web_confirm_scopes():    
-    if (SESSION_SCOPES_PRESELECTED not in session 
-            or SESSION_STATE not in session 
+    if (SESSION_STATE not in session 
             or SESSION_TEAM_ID not in session 
             or SESSION_USER_ID not in session):
-        print("ERROR: session corrupt")
+        logger.error("Session corrupt")
         abort(500)
 
-    # load current auth to display name on web page
+    # load current auth to display name and current scopes on web page
     team_id = session[SESSION_TEAM_ID]
     user_id = session[SESSION_USER_ID]            
-    with psycopg2.connect(DATABASE_URL) as connection:
+    with get_db_connection() as connection:
         my_auth = Authorization.fetchFromDb(
             connection, 
             team_id,
             user_id
         )
         if my_auth is not None:
+            scopes_preselected = my_auth.scopes
             team_name = my_auth.team_name
             user_name = my_auth.user_name
         else:
+            scopes_preselected = Scopes([Scopes.SCOPE_IDENTIFY])
             team_name = Authorization.fetch_workspace_name(connection, team_id)
             user_name = None
         
-    scopes_preselected = Scopes.create_from_string(
-        session[SESSION_SCOPES_PRESELECTED]
-    )
     scopes_added = Scopes(request.form.getlist(QUERY_SCOPES))
     scopes_all = scopes_added + scopes_preselected
         
-    state = session[SESSION_STATE]
-
-    query = {            
-        QUERY_OAUTH_CLIENT_ID: SLACK_CLIENT_ID,            
-        QUERY_OAUTH_SCOPE: scopes_all.get_string(),
-        QUERY_OAUTH_STATE: session[SESSION_STATE],            
-    }
-    if my_auth is not None:
-        query["team"] = my_auth.team_id
-    oauth_url = URL_OAUTH_AUTH + "?" + urllib.parse.urlencode(query)
+    oauth_url = create_oauth_url(
+        scopes_all.get_string(),
+        session[SESSION_STATE],
+        my_auth.team_id if my_auth is not None else None
+    )
 
     query = {
         QUERY_TEAM_ID: team_id,
@@ -665,7 +1110,11 @@ def web_finished_auth():
     if QUERY_OAUTH_ERROR in request.args:
         error = request.args[QUERY_OAUTH_ERROR]
     elif (QUERY_OAUTH_STATE not in request.args 
-            or (request.args[QUERY_OAUTH_STATE] != session[SESSION_STATE])):
+            or SESSION_STATE not in session
+            or not hmac.compare_digest(
+                request.args[QUERY_OAUTH_STATE].encode("utf-8"), 
+                session[SESSION_STATE].encode("utf-8")
+            )):
         error = "Invalid state"
     elif QUERY_OAUTH_CODE not in request.args:
         error = "no code returned"
@@ -691,14 +1140,19 @@ def web_finished_auth():
             scopes = Scopes.create_from_string(api_response["scope"])
             access_token = api_response["access_token"]
             
-            client = slack.WebClient(token=access_token)
-            api_response = client.auth_test()
-            assert api_response["ok"]
-            user_name = api_response["user"]
+            # only ask Slack for the user name if the response did not have it
+            user = api_response.get("user")
+            if isinstance(user, dict) and "name" in user:
+                user_name = user["name"]
+            else:
+                client = slack.WebClient(token=access_token)
+                api_response = client.auth_test()
+                assert api_response["ok"]
+                user_name = api_response["user"]
             
             # store the received auth to our DB for later use
             # will be marked as owner if it has the commands scope
-            with psycopg2.connect(DATABASE_URL) as connection:
+            with get_db_connection() as connection:
                 my_auth = Authorization(
                     team_id,
                     user_id,
@@ -708,22 +1162,23 @@ def web_finished_auth():
                     access_token
                 )
                 my_auth.store(connection)
+            Authorization.cache_invalidate(team_id, user_id)
 
             session[SESSION_TEAM_ID] = team_id
             session[SESSION_USER_ID] = user_id
+            # a state is only valid for one authorization
+            session.pop(SESSION_STATE, None)
             
             ## redirect to next page
             return redirect("/complete", code=302)
             
         except (Exception, psycopg2.Error) as error :
-            error = error
-            raise error
-            """
+            logger.exception("Failed to complete authorization: %s", error)
+            # details are only logged, they may contain internal information
             return render_template(
                 'error.html.j2',         
-                error=error,                
+                error="An internal error has occurred",                
             )
-            """
     else:
         return render_template(
             'error.html.j2',         
@@ -736,17 +1191,19 @@ def web_install_complete():
     """Show user installation result"""
 
     if SESSION_TEAM_ID not in session or SESSION_USER_ID not in session:
-        print("ERROR: Session corrupt")
+        logger.error("Session corrupt")
         abort(500)
 
     team_id = session[SESSION_TEAM_ID]
     user_id = session[SESSION_USER_ID]
 
-    with psycopg2.connect(DATABASE_URL) as connection:
+    # the auth was just stored, possibly by another worker
+    with get_db_connection() as connection:
         my_auth = Authorization.fetchFromDb(
             connection, 
             team_id,
-            user_id
+            user_id,
+            use_cache=False
         )
     
     if my_auth is None:
@@ -777,15 +1234,15 @@ def web_install_complete():
 @app.route('/slash', methods=['POST'])
 def slack_slash_request():                
     """endpoint for receiving all slash command requests from Slack"""
-    try:                
-        if not is_slack_request_valid(
-                ts=request.headers["X-Slack-Request-Timestamp"],
-                body=request.get_data().decode("utf-8"),            
-                signature=request.headers["X-Slack-Signature"],
-                signing_secret=SLACK_SIGNING_SECRET):
-            print("ERROR: Invalid Slack request")
-            abort(400)
+    if not is_slack_request_valid(
+            ts=request.headers["X-Slack-Request-Timestamp"],
+            body=request.get_data(),
+            signature=request.headers["X-Slack-Signature"],
+            signing_secret=SLACK_SIGNING_SECRET_BYTES):
+        logger.error("Invalid Slack request")
+        abort(400)
 
+    try:                
         # get token for current workspace
         team_id = request.form.get("team_id")
         user_id = request.form.get("user_id")
@@ -797,23 +1254,26 @@ def slack_slash_request():
             )
             
     except Exception as error:
-        print("ERROR: ", error)        
-        response_json = {
-            "text": "An internal error has occurred"
-        }
-        raise error
-        # return Response(response_json, mimetype='application/json')
+        logger.exception("Failed to process slash command: %s", error)
+        return Response(SLACK_ERROR_RESPONSE, mimetype='application/json')
 
     return ""
 
 
-def slack_create_main_menu(team_id: str, user_id: str) -> ResponseMessage:
-    """creates main menu"""
-    with psycopg2.connect(DATABASE_URL) as connection:
+def slack_create_main_menu(
+        team_id: str, 
+        user_id: str, 
+        use_cache: bool = True) -> ResponseMessage:
+    """creates main menu
+    
+    Set use_cache to False to always show the current auth from DB
+    """
+    with get_db_connection() as connection:
         my_auth = Authorization.fetchFromDb(
             connection, 
             team_id,
-            user_id
+            user_id,
+            use_cache=use_cache
         )
     # build call url and enforce https
     url_root = request.url_root    
@@ -855,9 +1315,10 @@ def slack_create_main_menu(team_id: str, user_id: str) -> ResponseMessage:
       
     else :                          
         # create response                                            
-        text = f"Your token is:\n>`{my_auth.token}`\nwith these scopes:\n"
-        for scope in my_auth.scopes.get_list():
-            text += f"• { scope }\n"
+        text = (
+            f"Your token is:\n>`{my_auth.token}`\nwith these scopes:\n"
+            + "".join(f"• { scope }\n" for scope in my_auth.scopes.get_list())
+        )
         actions = ActionsBlock([
             Button(
                 "Add Scopes", 
@@ -895,62 +1356,71 @@ def slack_interactive_request():
     """endpoint for receiving all slash command requests from Slack"""    
     if not is_slack_request_valid(
             ts=request.headers["X-Slack-Request-Timestamp"],
-            body=request.get_data().decode("utf-8"),            
+            body=request.get_data(),
             signature=request.headers["X-Slack-Signature"],
-            signing_secret=SLACK_SIGNING_SECRET):
-        print("ERROR: Invalid Slack request")
+            signing_secret=SLACK_SIGNING_SECRET_BYTES):
+        logger.error("Invalid Slack request")
         abort(400)
 
     if "payload" in request.form:                            
         # get context from current request
-        payload = json.loads(request.form["payload"])
-        # print(payload)                
+        payload = json_loads(request.form["payload"])
         team_id = payload["team"]["id"]
         user_id = payload["user"]["id"]        
         action_id = payload["actions"][0]["action_id"]
         
+        # other actions need no processing, e.g. new only opens a link
+        if action_id not in (AID_BUTTON_REMOVE, AID_BUTTON_REFRESH):
+            return ""
+
         try:            
-            with psycopg2.connect(DATABASE_URL) as connection:
-                # get token for current user
-                my_auth = Authorization.fetchFromDb(
-                    connection, 
-                    team_id,
-                    user_id
-                )                
-                if action_id == AID_BUTTON_REMOVE:
-                    # lets delete the old token
-                    if my_auth is None:
+            if action_id == AID_BUTTON_REMOVE:
+                with get_db_connection() as connection:
+                    # remove auth from storage and get its token.
+                    # deletion is only committed once the token is revoked
+                    token = Authorization.delete_returning(
+                        connection, 
+                        team_id,
+                        user_id
+                    )
+                    if token is None:
                         raise RuntimeError("could not find auth to delete")
                     
                     # revoke token
-                    client = slack.WebClient(token=my_auth.token)
+                    client = slack.WebClient(token=token)
                     res = client.auth_revoke()
                     assert res["ok"]
-                    
-                    # remove auth from storage
-                    my_auth.delete(connection)
-                    
-                    # inform user
-                    response_msg = ResponseMessage(
-                        text = "Your token has been deleted.",
-                        replace_original=True,
-                        delete_original=True
-                    )
-                    response_msg.send(payload["response_url"])
-                    
-                    # redraw menu
-                    # response_msg = create_main_menu(team_id, user_id)
-                    # response_msg.send(payload["response_url"])
-                    
-            
-                elif action_id == AID_BUTTON_REFRESH:                    
-                    response_msg = slack_create_main_menu(team_id, user_id)
-                    response_msg.replace_original = True
-                    response_msg.delete_original = True
-                    response_msg.send(payload["response_url"])
+                
+                # the deletion is committed now
+                Authorization.cache_invalidate(team_id, user_id)
+
+                # inform user
+                response_msg = ResponseMessage(
+                    text = "Your token has been deleted.",
+                    replace_original=True,
+                    delete_original=True
+                )
+                send_in_background(response_msg, payload["response_url"])
+                
+                # redraw menu
+                # response_msg = create_main_menu(team_id, user_id)
+                # response_msg.send(payload["response_url"])
+                
+            elif action_id == AID_BUTTON_REFRESH:
+                # opens its own connection block, so must not be nested in one
+                # the user asks for the current state, 
+                # which may have been changed by another worker
+                response_msg = slack_create_main_menu(
+                    team_id, 
+                    user_id, 
+                    use_cache=False
+                )
+                response_msg.replace_original = True
+                response_msg.delete_original = True
+                send_in_background(response_msg, payload["response_url"])
 
         except Exception as error:
-            print("ERROR: ", error)
+            logger.exception("Failed to process interactive request: %s", error)
             abort(500)
                 
     return ""
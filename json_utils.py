@@ -0,0 +1,29 @@
+# JSON helpers shared by app.py and slack_objects.py
+
+import json
+
+# parse and serialize JSON with the faster orjson if available
+# the stdlib fallback produces the same compact UTF-8 output
+try:
+    import orjson
+    json_loads = orjson.loads
+
+    def json_dumps_bytes(obj: any) -> bytes:
+        """returns the JSON representation of obj as UTF-8 bytes"""
+        return orjson.dumps(obj)
+
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps_bytes(obj: any) -> bytes:
+        """returns the JSON representation of obj as UTF-8 bytes"""
+        return json.dumps(
+            obj, 
+            ensure_ascii=False, 
+            separators=(",", ":")
+        ).encode("utf-8")
+
+
+def json_dumps(obj: any) -> str:
+    """returns the JSON representation of obj as string"""
+    return json_dumps_bytes(obj).decode("utf-8")
@@ -1,8 +1,17 @@
 import json
-import inspect
-from datetime import datetime
-import itertools
+import re
+from datetime import date
 import requests
+from requests.adapters import HTTPAdapter
+from json_utils import json_dumps, json_dumps_bytes
+
+# shared HTTP session, so that sending responses to Slack
+# can reuse open connections instead of doing a new TLS handshake each time
+_http_session = requests.Session()
+_http_session.mount(
+    "https://", 
+    HTTPAdapter(pool_connections=10, pool_maxsize=20)
+)
 
 ##########################################
 # Utility functions
@@ -21,6 +30,20 @@ def _str_or_none(value: any) -> any:
 class _Slack_Object:
     """Base class for all Slack objects"""
     
+    @classmethod
+    def _get_field_names(cls, obj: "_Slack_Object") -> tuple:
+        """returns the attribute and property names of all fields of a class
+
+        All fields are set in __init__, so they are the same for 
+        every object of a class and only need to be collected once 
+        from the first object
+        """
+        field_names = cls.__dict__.get("_FIELD_NAMES")
+        if field_names is None:
+            field_names = tuple((key, key[1:]) for key in obj.__dict__)
+            cls._FIELD_NAMES = field_names
+        return field_names
+
     def get_array(self) -> dict:        
         """returns the properties of an object as dict
         
@@ -28,34 +51,31 @@ class _Slack_Object:
         will call get_array() on relevant Slack objects
         """
         arr = dict()
-        for key, value in self.__dict__.items():
+        values = self.__dict__
+        for key, name in type(self)._get_field_names(self):
+            value = values[key]
             if value is not None:
                 if isinstance(value, list):
-                    v_list = list()
-                    for elem in value:
-                        if isinstance(elem, (_Slack_Object)):
-                            v_list.append(elem.get_array())
-                        else:    
-                            v_list.append(elem)
-                    arr[key[1:]] = v_list
+                    arr[name] = [
+                        elem.get_array() 
+                            if isinstance(elem, _Slack_Object) else elem
+                        for elem in value
+                    ]
                 else:
                     if isinstance(value, (_Slack_Object)):
-                        arr[key[1:]] = value.get_array()            
+                        arr[name] = value.get_array()            
                     else:    
-                        arr[key[1:]] = value
+                        arr[name] = value
         return arr
 
     def get_json(self) -> str:
-        return json.dumps(self.get_array())
+        return json_dumps(self.get_array())
     
     def __eq__(self, other):
         """object can now be compared by value, including nested objects"""
-        if not isinstance(other, type(self)):            
+        if type(other) is not type(self):
             return False    
-        return all(
-            self.__dict__[key1] == other.__dict__[key2] 
-                for key1, key2 in zip(self.__dict__.keys(), other.__dict__.keys())
-        )
+        return self.__dict__ == other.__dict__
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -69,7 +89,7 @@ class Text(_Slack_Object):
     """Text object used in Blocks"""
     TYPE_PLAIN_TEXT = "plain_text"
     TYPE_MRKDWN = "mrkdwn"
-    TYPES = [TYPE_PLAIN_TEXT, TYPE_MRKDWN]
+    TYPES = (TYPE_PLAIN_TEXT, TYPE_MRKDWN)
 
     def __init__(
             self, 
@@ -125,11 +145,13 @@ class Text(_Slack_Object):
         of many Blocks objects
         """
         if isinstance(text, str):
+            # a new Text always has the requested type
             text = cls(text, type)
-        elif not isinstance(text, cls):
+        elif isinstance(text, cls):
+            if type is not None and text.type != type:
+                raise TypeError(f"{name} must be of type {type}")
+        else:
             raise TypeError(f"{name} must be either string or {cls}")        
-        if type is not None and text.type != type:
-            raise TypeError(f"{name} must be of type {type}")
         if max_length is not None and len(text.text) > max_length:
             raise ValueError(
                 f"Maximum length of {name} is {max_length} characters"
@@ -262,10 +284,10 @@ class ImageElement(_BlockElement):
         super().__init__("image")
         image_url = str(image_url)
         if len(image_url) > 3000:
-            raise ValueError(f"Maximum length of image_url is 3000 characters")
+            raise ValueError("Maximum length of image_url is 3000 characters")
         alt_text = str(alt_text)
         if len(alt_text) > 2000:
-            raise ValueError(f"Maximum length of alt_text is 2000 characters")  
+            raise ValueError("Maximum length of alt_text is 2000 characters")  
         self._image_url = image_url
         self._alt_text = alt_text
 
@@ -307,7 +329,7 @@ class Button(_InteractiveElement):
     STYLE_PRIMARY = "primary"
     STYLE_DANGER = "danger"    
     STYLE_DEFAULT = None
-    _STYLES_DEF = [STYLE_DANGER, STYLE_PRIMARY]
+    _STYLES_DEF = (STYLE_DANGER, STYLE_PRIMARY)
 
     def __init__(
             self, 
@@ -323,15 +345,15 @@ class Button(_InteractiveElement):
         if url is not None:
             url = str(url)
             if  len(url) > 3000:
-                raise ValueError(f"Maximum length of url is 3000 characters")
+                raise ValueError("Maximum length of url is 3000 characters")
         if value is not None: 
             value = str(value)
             if len(value) > 2000:
-                raise ValueError(f"Maximum length of value is 2000 characters")
+                raise ValueError("Maximum length of value is 2000 characters")
         if style is not None:
             style = str(style)
             if style not in self._STYLES_DEF:
-                raise ValueError(f"invalid style")
+                raise ValueError("invalid style")
         
         # init
         self._text = text        
@@ -405,10 +427,11 @@ class SelectMenuStatic(_SelectMenuBase):
                 raise ValueError(
                     f"Maximum number of options is {self._MAX_OPTIONS}"
                 )
-            if any(not isinstance(x, Option) for x in options):
-                raise TypeError("options need to be of type Option")
-            if any(x.url is not None for x in options):
-                raise ValueError("url property in option not supported here")
+            for option in options:
+                if not isinstance(option, Option):
+                    raise TypeError("options need to be of type Option")
+                if option.url is not None:
+                    raise ValueError("url property in option not supported here")
         
         if option_groups is not None:
             if not isinstance(option_groups, list):
@@ -554,6 +577,8 @@ class SelectMenuChannels(_SelectMenuBase):
 
 
 class DatePicker(_SelectMenuBase):
+    _DATE_FORMAT = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
     def __init__(
             self,
             action_id: str,
@@ -572,8 +597,12 @@ class DatePicker(_SelectMenuBase):
                 raise ValueError(
                     "Maximum length of initial_date is 255 characters"
                 )
+            # the regex enforces the format, 
+            # since fromisoformat also accepts other ISO formats in newer Pythons
             try:
-                datetime.strptime(initial_date, "%Y-%M-%d")
+                if not self._DATE_FORMAT.fullmatch(initial_date):
+                    raise ValueError()
+                date.fromisoformat(initial_date)
             except ValueError:
                 raise ValueError(
                     "initial_date is not a valid date. Expecting: 'YYYY-MM-DD'"
@@ -638,12 +667,15 @@ class Section(_LayoutBlock):
             if all(isinstance(x, str) for x in fields):                
                 for i, field in enumerate(fields):
                     fields[i] = Text(fields[i], Text.TYPE_PLAIN_TEXT)
-            if any(not isinstance(x, Text) for x in fields):
-                raise TypeError("all elements in fields must be of type Text")
-            if any(len(x.text) > 2000 for x in fields):
-                raise TypeError(
-                    "Maximum length for all texts in field is 2000 characters"
-                )
+            for field in fields:
+                if not isinstance(field, Text):
+                    raise TypeError(
+                        "all elements in fields must be of type Text"
+                    )
+                if len(field.text) > 2000:
+                    raise TypeError(
+                        "Maximum length for all texts in field is 2000 characters"
+                    )
         if accessory is not None and not isinstance(accessory, _BlockElement):
             raise TypeError("accessory must be a _BlockElement")
         
@@ -681,10 +713,10 @@ class ImageBlock(_LayoutBlock):
         super().__init__("image", block_id)        
         image_url = str(image_url)
         if len(image_url) > 3000:
-            raise ValueError(f"Maximum length of image_url is 3000 characters")
+            raise ValueError("Maximum length of image_url is 3000 characters")
         alt_text = str(alt_text)
         if len(alt_text) > 2000:
-            raise ValueError(f"Maximum length of alt_text is 2000 characters")        
+            raise ValueError("Maximum length of alt_text is 2000 characters")        
         if title is not None:
             title = Text.convert_n_validate(
                 title, 
@@ -792,10 +824,7 @@ class Blocks(_Slack_Object):
         self._blocks = layout_blocks
     
     def get_array(self):
-        arr = list()
-        for layout_block in self._blocks:
-            arr.append(layout_block.get_array())
-        return arr
+        return [layout_block.get_array() for layout_block in self._blocks]
 
     def append(self, layout_block: _LayoutBlock):
         if not isinstance(layout_block, _LayoutBlock):
@@ -872,7 +901,7 @@ class ResponseMessage(Message):
     """
     TYPE_EPHEMERAL = "ephemeral"
     TYPE_IN_CHANNEL = "in_channel"
-    _TYPES_DEF = [TYPE_EPHEMERAL, TYPE_IN_CHANNEL]
+    _TYPES_DEF = (TYPE_EPHEMERAL, TYPE_IN_CHANNEL)
     
     def __init__(
             self,
@@ -927,7 +956,27 @@ class ResponseMessage(Message):
             raise TypeError("replace_original must be of Type bool")
         self._replace_original = value
 
-    def send(self, response_url: str):
-        res = requests.post(response_url, json=self.get_array())
+    def send(self, response_url: str, timeout: float = 10):
+        res = _http_session.post(
+            response_url, 
+            data=json_dumps_bytes(self.get_array()),
+            headers={"Content-Type": "application/json"},
+            timeout=timeout
+        )
+        res.raise_for_status()
+
+    async def send_async(self, response_url: str, client: object):
+        """sends this message with an async HTTP client, 
+        e.g. httpx.AsyncClient, so many messages can be sent concurrently
+        
+        Args:
+            response_url: URL to send this message to
+            client: async HTTP client with a post() coroutine
+        """
+        res = await client.post(
+            response_url, 
+            content=json_dumps_bytes(self.get_array()),
+            headers={"Content-Type": "application/json"}
+        )
         res.raise_for_status()
 
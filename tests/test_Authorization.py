@@ -5,8 +5,7 @@ import unittest
 import psycopg2
 import os
 import sys
-import inspect
-currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+currentdir = os.path.dirname(os.path.abspath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 from datetime import datetime
@@ -16,6 +15,9 @@ from app import Authorization, Scopes
 # database connection
 DATABASE_URL = os.environ['DATABASE_URL']
 
+# timestamp for test objects, the tests only compare it for equality
+FIXED_DT = pytz.utc.localize(datetime(2019, 9, 1, 12, 0, 0))
+
 class TestAuthorization(unittest.TestCase):
     
     @classmethod
@@ -25,22 +27,15 @@ class TestAuthorization(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        # remove test objects from DB
-        TestAuthorization.remove_test_data()
-        
         # close DB connection
         cls.connection.close()
 
+    def setUp(self):
+        Authorization.cache_clear()
 
-    @classmethod
-    def remove_test_data(cls):
-        with cls.connection.cursor() as cursor:
-            sql_query = """DELETE FROM mytoken_auths 
-                WHERE team_id = 'TEST01'
-                OR team_id = 'TEST01'
-                """
-            cursor.execute(sql_query)
-            cls.connection.commit()
+    def tearDown(self):
+        # tests never commit, so this removes all test objects from DB
+        self.connection.rollback()
 
     def test_create_minimal(self):        
         x = Authorization(
@@ -54,7 +49,7 @@ class TestAuthorization(unittest.TestCase):
     
 
     def test_getters(self):
-        dt = pytz.utc.localize(datetime.utcnow())
+        dt = FIXED_DT
         x = Authorization(
             "TEST01", 
             "U101", 
@@ -73,7 +68,7 @@ class TestAuthorization(unittest.TestCase):
 
 
     def test_store_1(self):
-        dt = pytz.utc.localize(datetime.utcnow())
+        dt = FIXED_DT
         x = Authorization(
             "TEST01", 
             "U101", 
@@ -101,7 +96,7 @@ class TestAuthorization(unittest.TestCase):
 
 
     def test_store_2(self):
-        dt = pytz.utc.localize(datetime.utcnow())
+        dt = FIXED_DT
         x = Authorization(
             "TEST01", 
             "U102", 
@@ -113,6 +108,39 @@ class TestAuthorization(unittest.TestCase):
         
         x.store(self.connection)
 
+    def test_store_many(self):
+        x = Authorization(
+            "TEST01", 
+            "U101", 
+            "team1",
+            "user1", 
+            Scopes("scope1"), 
+            "token1"
+        )
+        y = Authorization(
+            "TEST01", 
+            "U102", 
+            "team1",
+            "user2", 
+            Scopes("scope2"), 
+            "token2"
+        )
+        # same user again, last one should win
+        z = Authorization(
+            "TEST01", 
+            "U101", 
+            "team1",
+            "user1", 
+            Scopes("scope3"), 
+            "token3"
+        )
+        Authorization.store_many(self.connection, [x, y, z])
+        
+        x2 = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
+        self.assertEqual(x2, z)
+        y2 = Authorization.fetchFromDb(self.connection, "TEST01", "U102")
+        self.assertEqual(y2, y)
+
     def test_fetch_normal(self):        
         """store and then fetch same record. check if its identical"""
         x = Authorization(
@@ -126,14 +154,76 @@ class TestAuthorization(unittest.TestCase):
         x.store(self.connection)
         
         y = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
-        self.assertEqual(x.team_id, y.team_id)
-        self.assertEqual(x.user_id, y.user_id)
-        self.assertEqual(x.team_name, y.team_name)        
-        self.assertEqual(x.scopes, y.scopes)
-        self.assertEqual(x.token, y.token)        
-        self.assertEqual(x.last_update, y.last_update)
+        self.assertEqual(x, y)
     
 
+    def test_fetch_cached(self):
+        x = Authorization(
+            "TEST01", 
+            "U101", 
+            "team1",
+            "user1", 
+            Scopes("scope1"), 
+            "token1"
+        )        
+        x.store(self.connection)
+        y1 = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
+        y2 = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
+        self.assertIs(y1, y2)
+
+        # the cached object is only replaced once the caller invalidates it
+        x2 = Authorization(
+            "TEST01", 
+            "U101", 
+            "team1",
+            "user1", 
+            Scopes("scope1"), 
+            "token2"
+        )        
+        x2.store(self.connection)
+        y3 = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
+        self.assertIs(y3, y1)
+        
+        Authorization.cache_invalidate("TEST01", "U101")
+        y4 = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
+        self.assertEqual(y4.token, "token2")
+
+    def test_fetch_started_before_invalidation_is_not_cached(self):
+        generation = Authorization._cache_generation
+        Authorization.cache_invalidate("TEST01", "U101")
+        x = Authorization(
+            "TEST01", 
+            "U101", 
+            "team1",
+            "user1", 
+            Scopes("scope1"), 
+            "token1"
+        )        
+        Authorization._cache_set("TEST01", "U101", x, generation)
+        found, _ = Authorization._cache_get("TEST01", "U101")
+        self.assertFalse(found)
+
+    def test_fetch_cached_not_found(self):
+        y = Authorization.fetchFromDb(self.connection, "TEST01", "U103")
+        self.assertIsNone(y)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """INSERT INTO mytoken_auths (team_id, user_id, team_name, 
+                    user_name, scopes, token, last_update) 
+                VALUES ('TEST01', 'U103', 'team1', 'user1', 'scope1', 
+                    'token1', NOW())
+                """
+            )
+        y = Authorization.fetchFromDb(self.connection, "TEST01", "U103")
+        self.assertIsNone(y)
+        y = Authorization.fetchFromDb(
+            self.connection, 
+            "TEST01", 
+            "U103", 
+            use_cache=False
+        )
+        self.assertEqual(y.token, "token1")
+
     def test_fetch_unknown(self):
         y = Authorization.fetchFromDb(
             self.connection, 
@@ -150,24 +240,91 @@ class TestAuthorization(unittest.TestCase):
             "user1",
             Scopes("scope1"), 
             "token1",
-            pytz.utc.localize(datetime.utcnow())
+            FIXED_DT
         )        
         x.store(self.connection)
 
         y = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
-        self.assertEqual(x.team_id, y.team_id)
-        self.assertEqual(x.user_id, y.user_id)
-        self.assertEqual(x.team_name, y.team_name)        
-        self.assertEqual(x.scopes, y.scopes)
-        self.assertEqual(x.token, y.token)
+        self.assertEqual(x, y)
 
         x.delete(self.connection)
+        Authorization.cache_invalidate("TEST01", "U101")
+        y = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
+        self.assertIsNone(y)
+
+    def test_delete_returning(self):
+        x = Authorization(
+            "TEST01", 
+            "U101", 
+            "team1", 
+            "user1",
+            Scopes("scope1"), 
+            "token1"
+        )        
+        x.store(self.connection)
+
+        token = Authorization.delete_returning(
+            self.connection, 
+            "TEST01", 
+            "U101"
+        )
+        self.assertEqual(token, "token1")
         y = Authorization.fetchFromDb(self.connection, "TEST01", "U101")
         self.assertIsNone(y)
 
+        token = Authorization.delete_returning(
+            self.connection, 
+            "TEST01", 
+            "U101"
+        )
+        self.assertIsNone(token)
+
+    def test_delete_uncommitted_keeps_cache_valid(self):
+        # second connection to act like a request on another thread
+        connection_2 = psycopg2.connect(DATABASE_URL)
+        try:
+            x = Authorization(
+                "TEST01", 
+                "U101", 
+                "team1", 
+                "user1",
+                Scopes("scope1"), 
+                "token1",
+                FIXED_DT
+            )
+            with connection_2:
+                x.store(connection_2)
+            
+            # a read during the uncommitted deletion sees the old row
+            Authorization.delete_returning(self.connection, "TEST01", "U101")
+            y = Authorization.fetchFromDb(connection_2, "TEST01", "U101")
+            self.assertEqual(y, x)
+
+            # after a rollback the cached object is still correct
+            self.connection.rollback()
+            y = Authorization.fetchFromDb(connection_2, "TEST01", "U101")
+            self.assertEqual(y, x)
+
+            # a read right before the commit caches the old row again,
+            # so only invalidating after the commit makes the deletion visible
+            with self.connection:
+                Authorization.delete_returning(
+                    self.connection, 
+                    "TEST01", 
+                    "U101"
+                )
+                Authorization.fetchFromDb(connection_2, "TEST01", "U101")
+            y = Authorization.fetchFromDb(connection_2, "TEST01", "U101")
+            self.assertEqual(y, x)
+            Authorization.cache_invalidate("TEST01", "U101")
+            y = Authorization.fetchFromDb(connection_2, "TEST01", "U101")
+            self.assertIsNone(y)
+        finally:
+            with connection_2:
+                x.delete(connection_2)
+            connection_2.close()
+
     def test_count(self):
-        TestAuthorization.remove_test_data()        
-        
         # first should be zero
         self.assertEqual(Authorization.get_count_for_team(
             self.connection,
@@ -184,9 +341,6 @@ class TestAuthorization(unittest.TestCase):
             Scopes("scope1"), 
             "token1"
         )
-        
-        x.store(self.connection)
-                
         y = Authorization(
             "TEST01", 
             "U102", 
@@ -195,7 +349,7 @@ class TestAuthorization(unittest.TestCase):
             Scopes("scope2"), 
             "token2"
         )        
-        y.store(self.connection)
+        Authorization.store_many(self.connection, [x, y])
 
         # should be 2
         self.assertEqual(Authorization.get_count_for_team(
@@ -246,7 +400,7 @@ class TestAuthorization(unittest.TestCase):
         self.assertFalse(x.is_owner())
 
     def test_json_serialization(self):
-        dt = pytz.utc.localize(datetime.utcnow())
+        dt = FIXED_DT
         x = Authorization(
             "TEST01", 
             "U101", 
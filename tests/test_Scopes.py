@@ -1,11 +1,10 @@
-# unittest for Token class
-# requires a postgres DB with an existing table
+# unittest for Scopes class
+# does not need a database
 
 import unittest
 import os
 import sys
-import inspect
-currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+currentdir = os.path.dirname(os.path.abspath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 from app import Scopes
@@ -34,6 +33,10 @@ class TestScopes(unittest.TestCase):
         x = Scopes.create_from_file("scopes")        
         self.assertTrue("channels:history" in x)
         
+    def test_create_from_file_not_found(self):
+        with self.assertRaises(RuntimeError):
+            Scopes.create_from_file("does_not_exist")
+
     def test_create_ignore_empty_string_single(self):                        
         x = Scopes.create_from_string("")
         self.assertEqual(x.get_count(), 0)
@@ -65,9 +68,7 @@ class TestScopes(unittest.TestCase):
         s1 = ["a", "b", "c"]
         s2 = ["d", "e", "a"]
         x1 = Scopes(s1)
-        self.assertIsInstance(x1, Scopes)
         x2 = Scopes(s2)
-        self.assertIsInstance(x2, Scopes)
         x3 = x1 + x2
         self.assertIsInstance(x3, Scopes)
         self.assertCountEqual(x3.scopes, ["a", "b", "c", "d", "e"])
@@ -85,6 +86,14 @@ class TestScopes(unittest.TestCase):
         with self.assertRaises(ValueError):
             x.add("b,")
     
+    def test_add_scope_updates_sorted(self):
+        x = Scopes(["c", "a"])
+        self.assertEqual(x.get_string(), "a,c")
+        self.assertEqual(x.get_list(), ["a", "c"])
+        x.add("b")
+        self.assertEqual(x.get_string(), "a,b,c")
+        self.assertEqual(x.get_list(), ["a", "b", "c"])
+
     def test_diff(self):
         s1 = ["a", "b", "c", "d"]
         s2 = ["a", "c"]
@@ -93,6 +102,27 @@ class TestScopes(unittest.TestCase):
         x3 = x1.diff(x2)
         self.assertCountEqual(x3.scopes, ["b", "d"])
 
+    def test_operations_on_frozen_are_not_frozen(self):
+        x = Scopes(["scope1", "scope2"]).get_frozen()
+        y = x + Scopes(["scope3"])
+        y.add("scope4")
+        self.assertIn("scope4", y)
+        z = x.diff(Scopes(["scope1"]))
+        z.add("scope5")
+        self.assertEqual(z, Scopes(["scope2", "scope5"]))
+
+    def test_get_frozen(self):
+        x = Scopes(["a", "b", "c"])
+        y = x.get_frozen()
+        self.assertEqual(x, y)
+        self.assertIsInstance(y.scopes, frozenset)
+        with self.assertRaises(TypeError):
+            y.add("d")
+        
+        # operations still work with read-only scopes
+        z = y.diff(Scopes(["a"]))
+        self.assertCountEqual(z.scopes, ["b", "c"])
+
     def test_get_list(self):                        
         s = ["a", "d", "c", "b"]
         x = Scopes(s)        
@@ -110,6 +140,26 @@ class TestScopes(unittest.TestCase):
         s2 = Scopes(["a", "b", "c", "e"])
         
         self.assertNotEqual(s1, s2)
+    def test_known_names_share_one_string(self):
+        name = "".join(["comm", "ands"])
+        for x in [
+                Scopes([name]), 
+                Scopes.create_from_string("identify," + name)]:
+            self.assertIs(
+                next(y for y in x.scopes if y == name), 
+                Scopes._canonical_names[Scopes.SCOPE_COMMANDS]
+            )
+
+    def test_unknown_names_are_not_added_to_catalog(self):
+        x = Scopes(["unknown:scope1"])
+        x.add("unknown:scope2")
+        y = Scopes.create_from_string("unknown:scope3")
+        self.assertIn("unknown:scope1", x)
+        self.assertIn("unknown:scope2", x)
+        self.assertIn("unknown:scope3", y)
+        for name in ["unknown:scope1", "unknown:scope2", "unknown:scope3"]:
+            self.assertNotIn(name, Scopes._canonical_names)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -3,11 +3,39 @@
 import unittest
 import os
 import sys
-import inspect
-currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+currentdir = os.path.dirname(os.path.abspath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
-from app import Scopes
+from flask import request
+from flask.sessions import NullSession
+import urllib.parse
+import json
+import psycopg2
+import hmac
+import hashlib
+import time
+from unittest import mock
+from app import DATABASE_URL, app, Authorization, Scopes, create_oauth_url, is_slack_request_valid, SLACK_CLIENT_ID, get_db_pool, DB_POOL_MAX, execute_prepared, SLACK_SIGNING_SECRET_BYTES
+
+
+def post_signed(client: object, path: str, data: dict) -> object:
+    """posts form data to path like Slack would with a valid signature"""
+    body = urllib.parse.urlencode(data).encode("utf-8")
+    ts = str(int(time.time()))
+    signature = "v0=" + hmac.new(
+        SLACK_SIGNING_SECRET_BYTES, 
+        b"v0:" + ts.encode("utf-8") + b":" + body, 
+        hashlib.sha256
+    ).hexdigest()
+    return client.post(
+        path, 
+        data=body,
+        content_type="application/x-www-form-urlencoded",
+        headers={
+            "X-Slack-Request-Timestamp": ts,
+            "X-Slack-Signature": signature
+        }
+    )
 
 
 class TestAppFunctions(unittest.TestCase):
@@ -15,6 +43,238 @@ class TestAppFunctions(unittest.TestCase):
     def test_create1(self):                
         pass
 
+    def test_is_slack_request_valid(self):
+        ts = str(int(time.time()))
+        body = b"token=xyz&team_id=T001"
+        signature = "v0=" + hmac.new(
+            b"secret", 
+            b"v0:" + ts.encode("utf-8") + b":" + body, 
+            hashlib.sha256
+        ).hexdigest()
+        self.assertTrue(
+            is_slack_request_valid(ts, body, signature, b"secret")
+        )
+        self.assertFalse(
+            is_slack_request_valid(ts, body, signature, b"other")
+        )
+        self.assertFalse(
+            is_slack_request_valid(ts, body, "v0=äbc", b"secret")
+        )
+        self.assertFalse(
+            is_slack_request_valid(ts, body, signature[3:], b"secret")
+        )
+        self.assertFalse(
+            is_slack_request_valid("abc", body, signature, b"secret")
+        )
+
+    def test_is_slack_request_valid_rejects_old_requests(self):
+        ts = str(int(time.time()) - 60 * 6)
+        body = b"token=xyz&team_id=T001"
+        signature = "v0=" + hmac.new(
+            b"secret", 
+            b"v0:" + ts.encode("utf-8") + b":" + body, 
+            hashlib.sha256
+        ).hexdigest()
+        self.assertFalse(
+            is_slack_request_valid(ts, body, signature, b"secret")
+        )
+
+    def test_create_oauth_url(self):
+        url = create_oauth_url("chat:write,identify", "abc")
+        base, query_str = url.split("?")
+        self.assertEqual(base, "https://slack.com/oauth/authorize")
+        query = urllib.parse.parse_qs(query_str)
+        self.assertEqual(query["scope"], ["chat:write,identify"])
+        self.assertEqual(query["state"], ["abc"])
+        self.assertEqual(query["client_id"], [SLACK_CLIENT_ID])
+        self.assertNotIn("team", query)
+        
+        url = create_oauth_url("identify", "abc", "T001")
+        query = urllib.parse.parse_qs(url.split("?")[1])
+        self.assertEqual(query["team"], ["T001"])
+
+    def test_db_pool_reuses_connections(self):
+        pool = get_db_pool()
+        connections = [pool.getconn() for _ in range(DB_POOL_MAX)]
+        for connection in connections:
+            pool.putconn(connection)
+        
+        connections_2 = [pool.getconn() for _ in range(DB_POOL_MAX)]
+        for connection in connections_2:
+            pool.putconn(connection)
+        self.assertCountEqual(
+            [id(x) for x in connections_2], 
+            [id(x) for x in connections]
+        )
+        for connection in connections_2:
+            self.assertFalse(connection.closed)
+
+    def test_prepared_statement_survives_pool(self):
+        pool = get_db_pool()
+        connection = pool.getconn()
+        with connection.cursor() as cursor:
+            execute_prepared(cursor, "test_select", "SELECT $1::int", (1,))
+        pool.putconn(connection)
+
+        # the statement must still exist on the connection when reused
+        connections = [pool.getconn() for _ in range(DB_POOL_MAX)]
+        try:
+            self.assertIn(connection, connections)
+            with connection.cursor() as cursor:
+                cursor.execute("EXECUTE test_select (%s)", (2,))
+                self.assertEqual(cursor.fetchone()[0], 2)
+        finally:
+            for x in connections:
+                pool.putconn(x)
+
+    def test_no_session_for_slack_requests(self):
+        for path in ["/slash", "/interactive"]:
+            with app.test_request_context(path, method="POST"):
+                session = app.session_interface.open_session(app, request)
+                self.assertIsInstance(session, NullSession)
+
+        with app.test_request_context("/"):
+            session = app.session_interface.open_session(app, request)
+            self.assertNotIsInstance(session, NullSession)
+
+    def test_select_scopes_reuses_state(self):
+        with app.test_client() as client:
+            client.get("/")
+            with client.session_transaction() as session:
+                state = session["state"]
+            client.get("/")
+            with client.session_transaction() as session:
+                self.assertEqual(session["state"], state)
+
+    def test_finish_auth_rejects_invalid_state(self):
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session["state"] = "abc"
+            for state in ["abd", "äbc", ""]:
+                res = client.get("/finish_auth?state=" + state + "&code=x")
+                self.assertEqual(res.status_code, 200)
+                self.assertIn(b"Invalid state", res.data)
+
+    def test_finish_auth_shows_error_page_on_failure(self):
+        with mock.patch(
+                "slack.WebClient.oauth_access", 
+                side_effect=RuntimeError("failed")):
+            with app.test_client() as client:
+                with client.session_transaction() as session:
+                    session["state"] = "abc"
+                res = client.get("/finish_auth?state=abc&code=x")
+                self.assertEqual(res.status_code, 200)
+                self.assertIn(b"An internal error has occurred", res.data)
+
+    def test_slash_shows_main_menu(self):
+        with app.test_client() as client:
+            res = post_signed(
+                client, 
+                "/slash", 
+                {"team_id": "TEST01", "user_id": "U999"}
+            )
+            self.assertEqual(res.status_code, 200)
+            self.assertIn(b"You have not yet created a token", res.data)
+
+    def test_interactive_refresh_sends_main_menu(self):
+        payload = {
+            "team": {"id": "TEST01"},
+            "user": {"id": "U999"},
+            "actions": [{"action_id": "button_refresh"}],
+            "response_url": "https://hooks.slack.com/abc"
+        }
+        with mock.patch("app.send_in_background") as send_mock:
+            with app.test_client() as client:
+                res = post_signed(
+                    client, 
+                    "/interactive", 
+                    {"payload": json.dumps(payload)}
+                )
+            self.assertEqual(res.status_code, 200)
+            send_mock.assert_called_once()
+            response_msg, response_url = send_mock.call_args[0]
+            self.assertEqual(response_url, "https://hooks.slack.com/abc")
+            self.assertTrue(response_msg.replace_original)
+            self.assertIn("You have not yet created a token", 
+                response_msg.get_json())
+
+    def test_interactive_refresh_ignores_cached_auth(self):
+        # auth was deleted by another worker, but is still cached here
+        Authorization._cache_set(
+            "TEST01", 
+            "U999", 
+            Authorization(
+                "TEST01", 
+                "U999", 
+                "team1", 
+                "user1", 
+                Scopes(["commands"]), 
+                "token1"
+            ),
+            Authorization._cache_generation
+        )
+        payload = {
+            "team": {"id": "TEST01"},
+            "user": {"id": "U999"},
+            "actions": [{"action_id": "button_refresh"}],
+            "response_url": "https://hooks.slack.com/abc"
+        }
+        try:
+            with mock.patch("app.send_in_background") as send_mock:
+                with app.test_client() as client:
+                    post_signed(
+                        client, 
+                        "/interactive", 
+                        {"payload": json.dumps(payload)}
+                    )
+                response_msg = send_mock.call_args[0][0]
+                self.assertIn("You have not yet created a token", 
+                    response_msg.get_json())
+        finally:
+            Authorization.cache_clear()
+
+    def test_interactive_refresh_ignores_cached_not_found(self):
+        # auth was just created by another worker, 
+        # but is still cached as not found here
+        Authorization._cache_set(
+            "TEST01", 
+            "U998", 
+            None, 
+            Authorization._cache_generation
+        )
+        x = Authorization(
+            "TEST01", 
+            "U998", 
+            "team1", 
+            "user1", 
+            Scopes(["commands"]), 
+            "token998"
+        )
+        payload = {
+            "team": {"id": "TEST01"},
+            "user": {"id": "U998"},
+            "actions": [{"action_id": "button_refresh"}],
+            "response_url": "https://hooks.slack.com/abc"
+        }
+        connection = psycopg2.connect(DATABASE_URL)
+        try:
+            with connection:
+                x.store(connection)
+            with mock.patch("app.send_in_background") as send_mock:
+                with app.test_client() as client:
+                    post_signed(
+                        client, 
+                        "/interactive", 
+                        {"payload": json.dumps(payload)}
+                    )
+                response_msg = send_mock.call_args[0][0]
+                self.assertIn("token998", response_msg.get_json())
+        finally:
+            with connection:
+                x.delete(connection)
+            connection.close()
+            Authorization.cache_clear()
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,78 @@
+# unittest for slack_objects
+
+import unittest
+from unittest import mock
+import json
+import os
+import sys
+currentdir = os.path.dirname(os.path.abspath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+from slack_objects import DatePicker, ResponseMessage
+
+
+class TestDatePicker(unittest.TestCase):
+    
+    def test_create_minimal(self):
+        x = DatePicker("a1")
+        self.assertIsNone(x.initial_date)
+
+    def test_initial_date_valid(self):
+        for initial_date in ["2019-09-01", "2020-02-29", "2019-12-31"]:
+            x = DatePicker("a1", initial_date=initial_date)
+            self.assertEqual(x.initial_date, initial_date)
+            self.assertEqual(x.get_array()["initial_date"], initial_date)
+
+    def test_initial_date_invalid_date(self):
+        for initial_date in ["2020-02-30", "2019-02-29", "2020-13-01", 
+                "2020-00-10", "2020-04-31"]:
+            with self.assertRaises(ValueError):
+                DatePicker("a1", initial_date=initial_date)
+
+    def test_initial_date_malformed(self):
+        for initial_date in ["", "2020-2-3", "20200203", "2020/02/03", 
+                "2020-02-03T10:00", "x2020-02-03", "2020-02-03x", 
+                "２０２０-02-03", "2020-02-03\n", "a" * 256]:
+            with self.assertRaises(ValueError):
+                DatePicker("a1", initial_date=initial_date)
+
+    def test_date_format_rejects_malformed(self):
+        # must not rely on date.fromisoformat to reject these
+        for initial_date in ["2020-02-03\n", "２０２０-02-03", "2020-02-03x"]:
+            self.assertIsNone(DatePicker._DATE_FORMAT.fullmatch(initial_date))
+
+
+class TestResponseMessage(unittest.IsolatedAsyncioTestCase):
+
+    async def test_send_async(self):
+        client = mock.Mock()
+        # the response of httpx is not async, only the post call
+        client.post = mock.AsyncMock(return_value=mock.Mock())
+        x = ResponseMessage("hello", replace_original=True)
+        await x.send_async("https://hooks.slack.com/abc", client)
+
+        client.post.assert_awaited_once()
+        args, kwargs = client.post.call_args
+        self.assertEqual(args, ("https://hooks.slack.com/abc",))
+        self.assertEqual(
+            kwargs["headers"], 
+            {"Content-Type": "application/json"}
+        )
+        self.assertEqual(
+            json.loads(kwargs["content"]), 
+            {"text": "hello", "replace_original": True}
+        )
+        client.post.return_value.raise_for_status.assert_called_once()
+
+    async def test_send_async_raises_on_error(self):
+        client = mock.Mock()
+        client.post = mock.AsyncMock(return_value=mock.Mock())
+        client.post.return_value.raise_for_status.side_effect = \
+            RuntimeError("404")
+        x = ResponseMessage("hello")
+        with self.assertRaises(RuntimeError):
+            await x.send_async("https://hooks.slack.com/abc", client)
+
+
+if __name__ == '__main__':
+    unittest.main()